@@ -4,7 +4,10 @@
 # --------------------------------------------------------------------------------------------
 
 import os
+import re
+import weakref
 import zipfile
+from functools import lru_cache
 from random import randint
 from knack.util import CLIError
 from knack.log import get_logger
@@ -20,20 +23,111 @@ from .utils import get_resource_if_exists
 
 logger = get_logger(__name__)
 
+# Deployment zips are written once and extracted once, so favour speed over size: deflate level 1 is
+# several times faster than the default level 6 for a few percent larger archives. The level can be
+# overridden (0-9) with the AZ_APPSVC_ZIP_LEVEL environment variable.
+_ZIP_COMPRESS_LEVEL_ENV_VAR = 'AZ_APPSVC_ZIP_LEVEL'
+_ZIP_COMPRESS_LEVEL_DEFAULT = 1
+# version control, tooling caches and IDE folders are never part of the deployed app
+_ZIP_ALWAYS_SKIP_DIRS = {'.git', '.hg', '.svn', '.venv', '__pycache__', '.mypy_cache', '.pytest_cache', '.vs', '.idea'}
+
+_HTML_EXTENSIONS = {'.html', '.htm', '.shtml'}
+_CSPROJ_EXTENSIONS = {'.csproj'}
+# language detection also skips the dependency and build output folders of the supported languages
+_LANG_DETECTION_SKIP_DIRS = _ZIP_ALWAYS_SKIP_DIRS | {'node_modules', 'bin', 'obj'}
+
+_NON_DECIMAL_RE = re.compile(r'[^\d.]+')
+_NON_ALPHA_RE = re.compile(r'([^a-zA-Z\s]+?)')
+_VERSION_RE = re.compile(r'\d+\.\d+')
+_DOTNET_TARGET_FRAMEWORK_RE = re.compile(DOTNET_TARGET_FRAMEWORK_REGEX)
+
+
+# The helpers used by `az webapp up` each ask for their own client, so clients are kept per CLI context instead
+# of being built on every call. A CLI context going away drops its clients.
+_mgmt_clients = weakref.WeakKeyDictionary()
+
+
+def _get_cached_mgmt_service_client(cli_ctx, client_or_resource_type):
+    from azure.cli.core._profile import Profile
+    # the client is bound to the cloud, subscription and account that are current when it is built, so only
+    # reuse it while they still are (e.g. not after `az account set`, `az login` or `az cloud set`)
+    subscription = Profile(cli_ctx=cli_ctx).get_subscription(cli_ctx.data.get('subscription_id'))
+    key = (client_or_resource_type, cli_ctx.cloud.name, subscription['id'], subscription['tenantId'],
+           subscription['user']['name'])
+    clients = _mgmt_clients.setdefault(cli_ctx, {})
+    if key not in clients:
+        clients[key] = get_mgmt_service_client(cli_ctx, client_or_resource_type)
+    return clients[key]
+
 
 def _resource_client_factory(cli_ctx, **_):
     from azure.cli.core.profiles import ResourceType
-    return get_mgmt_service_client(cli_ctx, ResourceType.MGMT_RESOURCE_RESOURCES)
+    return _get_cached_mgmt_service_client(cli_ctx, ResourceType.MGMT_RESOURCE_RESOURCES)
 
 
 def web_client_factory(cli_ctx, **_):
     from azure.mgmt.web import WebSiteManagementClient
-    return get_mgmt_service_client(cli_ctx, WebSiteManagementClient)
+    return _get_cached_mgmt_service_client(cli_ctx, WebSiteManagementClient)
 
 
 def log_analytics_client_factory(cli_ctx, **_):
     from azure.mgmt.loganalytics import LogAnalyticsManagementClient
-    return get_mgmt_service_client(cli_ctx, LogAnalyticsManagementClient)
+    return _get_cached_mgmt_service_client(cli_ctx, LogAnalyticsManagementClient)
+
+
+# os.walk equivalent built on os.scandir, yielding the os.DirEntry objects so callers can reuse the
+# information already returned by the directory listing instead of stat-ing every entry again.
+# Like os.walk (top-down), dir_entries can be pruned in place to skip subdirectories.
+def _scandir_walk(top):
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        dir_entries = []
+        file_entries = []
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        dir_entries.append(entry)
+                    else:
+                        file_entries.append(entry)
+        except OSError:
+            continue
+        yield dirpath, dir_entries, file_entries
+        # like os.walk, do not follow symlinks to directories; reversed keeps the os.walk visiting order
+        stack.extend(d.path for d in reversed(dir_entries) if not d.is_symlink())
+
+
+def _get_zip_compress_level():
+    level = os.environ.get(_ZIP_COMPRESS_LEVEL_ENV_VAR)
+    if level is None:
+        return _ZIP_COMPRESS_LEVEL_DEFAULT
+    try:
+        if 0 <= int(level) <= 9:
+            return int(level)
+    except ValueError:
+        pass
+    logger.warning("Ignoring invalid value '%s' of %s, it should be an integer between 0 and 9. "
+                   "Defaulting to %s", level, _ZIP_COMPRESS_LEVEL_ENV_VAR, _ZIP_COMPRESS_LEVEL_DEFAULT)
+    return _ZIP_COMPRESS_LEVEL_DEFAULT
+
+
+def _skip_dir_in_zip(dir_name, lang):
+    if dir_name in _ZIP_ALWAYS_SKIP_DIRS:
+        return True
+    # skip node_modules folder for Node apps,
+    # since zip_deployment will perform the build operation
+    if lang.lower() == NODE_RUNTIME_NAME:
+        return 'node_modules' in dir_name
+    if lang.lower() == NETCORE_RUNTIME_NAME:
+        return dir_name in ['obj', 'bin']
+    if lang.lower() == PYTHON_RUNTIME_NAME:
+        return 'env' in dir_name  # Ignores dir that contain env
+    return False
 
 
 def zip_contents_from_dir(dirPath, lang):
@@ -46,38 +140,39 @@ def zip_contents_from_dir(dirPath, lang):
     zip_file_path = relroot + os.path.sep + file_val_unique + ".zip"
     abs_src = os.path.abspath(dirPath)
     try:
-        with zipfile.ZipFile("{}".format(zip_file_path), "w", zipfile.ZIP_DEFLATED) as zf:
-            for dirname, subdirs, files in os.walk(dirPath):
-                # skip node_modules folder for Node apps,
-                # since zip_deployment will perform the build operation
-                if lang.lower() == NODE_RUNTIME_NAME:
-                    subdirs[:] = [d for d in subdirs if 'node_modules' not in d]
-                elif lang.lower() == NETCORE_RUNTIME_NAME:
-                    subdirs[:] = [d for d in subdirs if d not in ['obj', 'bin']]
-                elif lang.lower() == PYTHON_RUNTIME_NAME:
-                    subdirs[:] = [d for d in subdirs if 'env' not in d]  # Ignores dir that contain env
+        dotnet_references = None
+        if lang.lower() == NETCORE_RUNTIME_NAME:
+            dotnet_references = _get_dotnet_references_to_bundle(abs_src)
 
+        with zipfile.ZipFile("{}".format(zip_file_path), "w", zipfile.ZIP_DEFLATED,
+                             compresslevel=_get_zip_compress_level()) as zf:
+            for dirname, subdirs, files in _scandir_walk(abs_src):
+                subdirs[:] = [d for d in subdirs if not _skip_dir_in_zip(d.name, lang)]
+                if lang.lower() == PYTHON_RUNTIME_NAME:
                     filtered_files = []
-                    for filename in files:
-                        if filename == '.env':
-                            logger.info("Skipping file: %s/%s", dirname, filename)
+                    for file_entry in files:
+                        if file_entry.name == '.env':
+                            logger.info("Skipping file: %s/%s", dirname, file_entry.name)
                         else:
-                            filtered_files.append(filename)
+                            filtered_files.append(file_entry)
                     files[:] = filtered_files
 
-                for filename in files:
-                    absname = os.path.abspath(os.path.join(dirname, filename))
+                for file_entry in files:
+                    # when bundling dotnet project references, the main project .csproj is rewritten below
+                    if dotnet_references and file_entry.name.endswith('.csproj'):
+                        continue
+                    absname = file_entry.path
                     arcname = absname[len(abs_src) + 1:]
                     zf.write(absname, arcname)
 
-        if lang.lower() == NETCORE_RUNTIME_NAME:
-            from xml.etree.ElementTree import ParseError
-            from zipfile import BadZipFile, LargeZipFile
-            try:
-                zip_dotnet_project_references(abs_src, "{}".format(zip_file_path))
-            except (OSError, ValueError, TypeError, ParseError, BadZipFile, LargeZipFile):
-                logger.warning("Analysing and bundling dotnet project references have failed.")
+            if dotnet_references:
+                zip_dotnet_project_references(zf, abs_src, *dotnet_references)
     except OSError as e:
+        # don't leave a partial zip behind
+        try:
+            os.remove(zip_file_path)
+        except OSError:
+            pass
         if e.errno == 13:
             raise CLIError('Insufficient permissions to create a zip in current directory. '
                            'Please re-run the command with administrator privileges')
@@ -133,19 +228,25 @@ def check_resource_group_exists(cmd, rg_name):
 def _check_resource_group_supports_os(cmd, rg_name, is_linux):
     # get all appservice plans from RG
     client = web_client_factory(cmd.cli_ctx)
-    plans = list(client.app_service_plans.list_by_resource_group(rg_name))
-    for item in plans:
-        # for Linux if an app with reserved==False exists, ASP doesn't support Linux
-        if is_linux and not item.reserved:
-            return False
-        if not is_linux and item.reserved:
-            return False
-    return True
+    plans = client.app_service_plans.list_by_resource_group(rg_name)
+    # for Linux if an app with reserved==False exists, ASP doesn't support Linux (and vice versa)
+    return all(bool(item.reserved) == bool(is_linux) for item in plans)
 
 
 def get_num_apps_in_asp(cmd, rg_name, asp_name):
     client = web_client_factory(cmd.cli_ctx)
-    return len(list(client.app_service_plans.list_web_apps(rg_name, asp_name)))
+    return sum(1 for _ in client.app_service_plans.list_web_apps(rg_name, asp_name))
+
+
+# Return the first file under src_path with one of the (lowercase) extensions, or "" if there is none.
+# The walk stops at the first hit and skips directories that never hold the app's own markers.
+def _find_lang_marker_file(src_path, extensions):
+    for _dirpath, dir_entries, file_entries in _scandir_walk(src_path):
+        for file_entry in file_entries:
+            if os.path.splitext(file_entry.name)[1].lower() in extensions:
+                return file_entry.path
+        dir_entries[:] = [d for d in dir_entries if d.name not in _LANG_DETECTION_SKIP_DIRS]
+    return ""
 
 
 # pylint:disable=unexpected-keyword-arg
@@ -157,25 +258,12 @@ def get_lang_from_content(src_path, html=False, is_linux=False):
     runtime_details_dict = dict.fromkeys(['language', 'file_loc', 'default_sku'])
     package_json_file = os.path.join(src_path, 'package.json')
     package_python_file = os.path.join(src_path, 'requirements.txt')
-    static_html_file = ""
-    package_netcore_file = ""
     runtime_details_dict['language'] = ''
     runtime_details_dict['file_loc'] = ''
     runtime_details_dict['default_sku'] = 'F1'
-    import fnmatch
-    for _dirpath, _dirnames, files in os.walk(src_path):
-        for file in files:
-            if html and (fnmatch.fnmatch(file, "*.html") or fnmatch.fnmatch(file, "*.htm") or
-                         fnmatch.fnmatch(file, "*shtml.")):
-                static_html_file = os.path.join(src_path, file)
-                break
-            if fnmatch.fnmatch(file, "*.csproj"):
-                package_netcore_file = os.path.join(src_path, file)
-                if not os.path.isfile(package_netcore_file):
-                    package_netcore_file = os.path.join(_dirpath, file)
-                break
 
     if html:
+        static_html_file = _find_lang_marker_file(src_path, _HTML_EXTENSIONS)
         if static_html_file:
             runtime_details_dict['language'] = STATIC_RUNTIME_NAME
             runtime_details_dict['file_loc'] = static_html_file
@@ -191,37 +279,51 @@ def get_lang_from_content(src_path, html=False, is_linux=False):
         runtime_details_dict['language'] = NODE_RUNTIME_NAME
         runtime_details_dict['file_loc'] = package_json_file if os.path.isfile(package_json_file) else ''
         runtime_details_dict['default_sku'] = LINUX_SKU_DEFAULT
-    elif package_netcore_file:
+    else:
+        # the source tree is only walked for a .csproj once the markers at the root have been ruled out
+        package_netcore_file = _find_lang_marker_file(src_path, _CSPROJ_EXTENSIONS)
+        if not package_netcore_file:  # TODO: Update the doc when the detection logic gets updated
+            raise CLIError("Could not auto-detect the runtime stack of your app.\n"
+                           "HINT: Are you in the right folder?\n"
+                           "For more information, see 'https://go.microsoft.com/fwlink/?linkid=2109470'")
         runtime_lang = detect_dotnet_lang(package_netcore_file, is_linux=is_linux)
         runtime_details_dict['language'] = runtime_lang
         runtime_details_dict['file_loc'] = package_netcore_file
         runtime_details_dict['default_sku'] = 'F1'
-    else:  # TODO: Update the doc when the detection logic gets updated
-        raise CLIError("Could not auto-detect the runtime stack of your app.\n"
-                       "HINT: Are you in the right folder?\n"
-                       "For more information, see 'https://go.microsoft.com/fwlink/?linkid=2109470'")
     return runtime_details_dict
 
 
-def detect_dotnet_lang(csproj_path, is_linux=False):
+# Return the text of the first element named after one of `tags` (given in order of preference), or None.
+# The file is parsed incrementally and parsing stops on the most preferred tag. Tags are compared without
+# their XML namespace, as old style .csproj files declare the msbuild namespace.
+def _first_element_text(xml_path, tags):
     import xml.etree.ElementTree as ET
-    import re
 
+    found = {}
+    for _event, elem in ET.iterparse(xml_path, events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag in tags and tag not in found:
+            found[tag] = elem.text
+            if tag == tags[0]:
+                break
+        elem.clear()
+    return next((found[tag] for tag in tags if tag in found), None)
+
+
+def detect_dotnet_lang(csproj_path, is_linux=False):
     if is_linux:
         return NETCORE_RUNTIME_NAME
 
-    parsed_file = ET.parse(csproj_path)
-    root = parsed_file.getroot()
     version_lang = ''
     version_full = ''
-    for target_ver in root.iter('TargetFramework'):
-        version_full = target_ver.text
-        version_full = ''.join(version_full.split()).lower()
-        version_lang = re.sub(r'([^a-zA-Z\s]+?)', '', target_ver.text)
+    target_ver = _first_element_text(csproj_path, ('TargetFramework',))
+    if target_ver is not None:
+        version_full = ''.join(target_ver.split()).lower()
+        version_lang = _NON_ALPHA_RE.sub('', target_ver)
 
     if 'netcore' in version_lang.lower():
         return NETCORE_RUNTIME_NAME
-    if version_full and re.fullmatch(DOTNET_TARGET_FRAMEWORK_REGEX, version_full):
+    if version_full and _DOTNET_TARGET_FRAMEWORK_RE.fullmatch(version_full):
         return DOTNET_RUNTIME_NAME
     return ASPDOTNET_RUNTIME_NAME
 
@@ -229,19 +331,11 @@ def detect_dotnet_lang(csproj_path, is_linux=False):
 def parse_dotnet_version(file_path, default_version):
     version_detected = [default_version]
     try:
-        from xml.dom import minidom
-        import re
-        xmldoc = minidom.parse(file_path)
-        framework_ver = xmldoc.getElementsByTagName('TargetFrameworkVersion')
-        if not framework_ver:
-            framework_ver = xmldoc.getElementsByTagName('TargetFramework')
-        target_ver = framework_ver[0].firstChild.data
-        non_decimal = re.compile(r'[^\d.]+')
+        target_ver = _first_element_text(file_path, ('TargetFrameworkVersion', 'TargetFramework'))
         # reduce the version to '5.7.4' from '5.7'
-        if target_ver is not None:
-            # remove the string from the beginning of the version value
-            c = non_decimal.sub('', target_ver)
-            version_detected = c[:3]
+        # remove the string from the beginning of the version value
+        c = _NON_DECIMAL_RE.sub('', target_ver)
+        version_detected = c[:3]
     except:  # pylint: disable=bare-except
         logger.warning("Could not parse dotnet version from *.csproj. Defaulting to %s", version_detected[0])
         version_detected = version_detected[0]
@@ -249,13 +343,10 @@ def parse_dotnet_version(file_path, default_version):
 
 
 def parse_netcore_version(file_path):
-    import xml.etree.ElementTree as ET
-    import re
     version_detected = ['0.0']
-    parsed_file = ET.parse(file_path)
-    root = parsed_file.getroot()
-    for target_ver in root.iter('TargetFramework'):
-        version_detected = re.findall(r"\d+\.\d+", target_ver.text)
+    target_ver = _first_element_text(file_path, ('TargetFramework',))
+    if target_ver is not None:
+        version_detected = _VERSION_RE.findall(target_ver)
     # incase of multiple versions detected, return list in descending order
     version_detected = sorted(version_detected, key=float, reverse=True)
     return version_detected
@@ -264,16 +355,14 @@ def parse_netcore_version(file_path):
 def parse_node_version(file_path):
     # from node experts the node value in package.json can be found here   "engines": { "node":  ">=10.6.0"}
     import json
-    import re
     version_detected = []
     with open(file_path) as data_file:
         data = json.load(data_file)
         for key, value in data.items():
             if key == 'engines' and 'node' in value:
                 value_detected = value['node']
-                non_decimal = re.compile(r'[^\d.]+')
                 # remove the string ~ or  > that sometimes exists in version value
-                c = non_decimal.sub('', value_detected)
+                c = _NON_DECIMAL_RE.sub('', value_detected)
                 # reduce the version to '6.0' from '6.0.0'
                 if '.' in c:  # handle version set as 4 instead of 4.0
                     num_array = c.split('.')
@@ -284,11 +373,17 @@ def parse_node_version(file_path):
     return version_detected or ['0.0']
 
 
+# sort key for versions like '6.0' or 'V4.8', so that '10.0' sorts after '6.0'
+def _version_key(version):
+    return tuple(int(part) for part in _NON_DECIMAL_RE.sub('', version).split('.') if part)
+
+
 def detect_dotnet_version_tocreate(detected_ver, default_version, versions_list):
-    min_ver = versions_list[0]
     if detected_ver in versions_list:
         return detected_ver
-    if detected_ver < min_ver:
+    # versions_list isn't necessarily sorted
+    min_ver = min(versions_list, key=_version_key)
+    if _version_key(detected_ver) < _version_key(min_ver):
         return min_ver
     return default_version
 
@@ -300,22 +395,30 @@ def detect_node_version_tocreate(detected_ver, node_versions, default_node_versi
     return default_node_version
 
 
+# Yield the values of `key` in json_data and its nested dicts, in document order. Iterates with an explicit
+# stack instead of recursing, so deeply nested documents don't hit the recursion limit.
 def find_key_in_json(json_data, key):
-    for k, v in json_data.items():
-        if key in k:
-            yield v
-        elif isinstance(v, dict):
-            yield from find_key_in_json(v, key)
+    stack = [iter(json_data.items())]
+    while stack:
+        for k, v in stack[-1]:
+            if k == key:
+                yield v
+            elif isinstance(v, dict):
+                stack.append(iter(v.items()))
+                break
+        else:
+            stack.pop()
 
 
 def set_location(cmd, sku, location):
     client = web_client_factory(cmd.cli_ctx)
     if location is None:
-        locs = client.list_geo_regions(sku, True)
-        available_locs = []
-        for loc in locs:
-            available_locs.append(loc.name)
-        loc = available_locs[0]
+        # only the first region is used, avoid paging through the others
+        region = next(iter(client.list_geo_regions(sku, True)), None)
+        if region is None:
+            raise CLIError("Unable to find a region supporting the '{}' sku. Please specify a location using "
+                           "--location flag".format(sku))
+        loc = region.name
     else:
         loc = location
     return loc.replace(" ", "").lower()
@@ -336,12 +439,16 @@ def get_site_availability(cmd, name):
 
 
 def get_app_details(cmd, name):
+    from azure.mgmt.core.tools import parse_resource_id
     client = web_client_factory(cmd.cli_ctx)
-    data = (list(filter(lambda x: name.lower() == x.name.lower(), client.web_apps.list())))
-    _num_items = len(data)
-    if _num_items > 0:
-        return data[0]
-    return None
+    # look the app up by name through ARM rather than listing all the apps of the subscription
+    rcf = _resource_client_factory(cmd.cli_ctx)
+    resource_filter = "resourceType eq 'Microsoft.Web/sites' and name eq '{}'".format(name.replace("'", "''"))
+    resource = next(iter(rcf.resources.list(filter=resource_filter)), None)
+    if resource is None:
+        return None
+    return get_resource_if_exists(client.web_apps, name=resource.name,
+                                  resource_group_name=parse_resource_id(resource.id)['resource_group'])
 
 
 def get_rg_to_use(user, rg_name=None):
@@ -360,13 +467,14 @@ def get_profile_username():
     return user
 
 
-def get_sku_to_use(src_dir, html=False, sku=None, runtime=None, app_service_environment=None):
+# lang_details is the result of get_lang_from_content when the caller already detected the language
+def get_sku_to_use(src_dir, html=False, sku=None, runtime=None, app_service_environment=None, lang_details=None):
     if sku is None:
         if app_service_environment:
             return 'I1v2'
         if runtime:  # user overrided language detection by specifiying runtime
             return 'F1'
-        lang_details = get_lang_from_content(src_dir, html)
+        lang_details = lang_details or get_lang_from_content(src_dir, html)
         return lang_details.get("default_sku")
     logger.info("Found sku argument, skipping use default sku")
     return sku
@@ -377,12 +485,13 @@ def set_language(src_dir, html=False):
     return lang_details.get('language')
 
 
-def detect_os_from_src(src_dir, html=False, runtime=None):
+# lang_details is the result of get_lang_from_content when the caller already detected the language
+def detect_os_from_src(src_dir, html=False, runtime=None, lang_details=None):
     from .custom import _StackRuntimeHelper
     if runtime:
         language = runtime.split(_StackRuntimeHelper.DEFAULT_DELIMETER)[0]
     else:
-        language = get_lang_from_content(src_dir, html).get('language')
+        language = (lang_details or get_lang_from_content(src_dir, html)).get('language')
     return "Linux" if language is not None and language.lower() == NODE_RUNTIME_NAME \
         or language.lower() == PYTHON_RUNTIME_NAME else OS_DEFAULT
 
@@ -420,23 +529,20 @@ def _determine_if_default_plan_to_use(cmd, plan_name, resource_group_name, loc,
     if create_rg:  # if new RG needs to be created use the default name
         return plan_name
 
-    # get all ASPs in the RG & filter to the ones that contain the plan_name
+    # go through the ASPs in the RG that contain the plan_name
     _asp_generic = plan_name[:plan_name.rindex("_")]
-    _asp_list = (list(filter(lambda x: _asp_generic in x.name,
-                             client.app_service_plans.list_by_resource_group(resource_group_name))))
-    _num_asp = len(_asp_list)
-    if _num_asp:
+    _plan_info = None
+    for a in client.app_service_plans.list_by_resource_group(resource_group_name):
+        if _asp_generic not in a.name:
+            continue
         # check if we have at least one app that can be used with the combination of loc, sku & os
-        selected_asp = next((a for a in _asp_list if isinstance(a.sku, SkuDescription) and
-                             a.sku.name.lower() == sku.lower() and
-                             (a.location.replace(" ", "").lower() == loc.lower()) and
-                             a.reserved == is_linux), None)
-        if selected_asp is not None:
-            return selected_asp.name
-        # from the sorted data pick the last one & check if a new ASP needs to be created
-        # based on SKU or not
-        data_sorted = sorted(_asp_list, key=lambda x: x.name)
-        _plan_info = data_sorted[_num_asp - 1]
+        if (isinstance(a.sku, SkuDescription) and a.sku.name.lower() == sku.lower() and
+                (a.location.replace(" ", "").lower() == loc.lower()) and a.reserved == is_linux):
+            return a.name
+        # keep the last one by name to check if a new ASP needs to be created based on SKU or not
+        if _plan_info is None or a.name > _plan_info.name:
+            _plan_info = a
+    if _plan_info is not None:
         _asp_num = 1
         try:
             _asp_num = int(_plan_info.name.split('_')[-1]) + 1  # default asp created by CLI can be of type plan_num
@@ -448,10 +554,12 @@ def _determine_if_default_plan_to_use(cmd, plan_name, resource_group_name, loc,
 
 def should_create_new_app(cmd, rg_name, app_name):  # this is currently referenced by an extension command
     client = web_client_factory(cmd.cli_ctx)
-    for item in list(client.web_apps.list_by_resource_group(rg_name)):
-        if item.name.lower() == app_name.lower():
-            return False
-    return True
+    return get_resource_if_exists(client.web_apps, resource_group_name=rg_name, name=app_name) is None
+
+
+@lru_cache(maxsize=1)
+def _get_random_app_names():
+    return get_file_json(GENERATE_RANDOM_APP_NAMES)
 
 
 def generate_default_app_name(cmd):
@@ -459,8 +567,9 @@ def generate_default_app_name(cmd):
         import uuid
         from random import choice
 
-        noun = choice(get_file_json(GENERATE_RANDOM_APP_NAMES)['APP_NAME_NOUNS'])
-        adjective = choice(get_file_json(GENERATE_RANDOM_APP_NAMES)['APP_NAME_ADJECTIVES'])
+        random_names = _get_random_app_names()
+        noun = choice(random_names['APP_NAME_NOUNS'])
+        adjective = choice(random_names['APP_NAME_ADJECTIVES'])
         random_uuid = str(uuid.uuid4().hex)
 
         name = '{}-{}-{}'.format(adjective, noun, random_uuid)
@@ -567,95 +676,101 @@ def _get_dotnet_project_references(csproj_path):
 
 # List the missing project references because of transitive dependencies
 def _get_dotnet_transitive_missing_references(current_references):
-    result_references = list(current_references)
+    result_references = []
+    known_references = set(current_references)
     newReference = set(current_references)
 
     while any(newReference):
         reference = newReference.pop()
         abs_references = _get_dotnet_project_references(reference)
         for suggested_reference in abs_references:
-            if suggested_reference not in result_references:
+            if suggested_reference not in known_references:
+                known_references.add(suggested_reference)
                 result_references.append(suggested_reference)
                 newReference.add(suggested_reference)
 
-    return list(set(result_references) - set(current_references))
-
+    return result_references
 
-# Append dotnet references in a zip file according to a list of absolute references
-def _append_dotnet_references(dirPath, abs_references, zip_file_path):
-    # dictionary with key[str]=project reference path, value[str]=new project reference
-    replace_dict = {}
 
-    with zipfile.ZipFile(zip_file_path, "a", zipfile.ZIP_DEFLATED) as tmp_zf:
-        for include in abs_references:
-            abs_include = os.path.abspath(os.path.join(dirPath, include))
-            dirname_include = os.path.dirname(abs_include)
-            basename_dir_include = os.path.basename(dirname_include)
-            csproj_include = os.path.join(
-                DOTNET_REFERENCES_DIR_IN_ZIP, basename_dir_include, abs_include[len(dirname_include) + 1:])
-
-            # Copy project references (excluding obj, bin folders)
-            for dirname, subdirs, files in os.walk(dirname_include):
-                subdirs[:] = [d for d in subdirs if d not in ['obj', 'bin']]
-                for filename in files:
-                    absname = os.path.abspath(os.path.join(dirname, filename))
-                    arcname = os.path.join(
-                        DOTNET_REFERENCES_DIR_IN_ZIP, basename_dir_include, absname[len(dirname_include) + 1:])
-                    tmp_zf.write(absname, arcname)
-
-            # backup project reference .csproj and prepare for replacing
-            tmp_zf.write(abs_include, csproj_include + ".bak")
-            replace_dict[include] = csproj_include
+# Analyse the main project of a dotnet webapp. When it has local project references to bundle, return
+# (csproj_path, rewritten csproj content, direct references, transitive references), None otherwise.
+# Everything that can fail on the project content happens here, before anything is written to the zip.
+def _get_dotnet_references_to_bundle(dirPath):
+    from xml.etree.ElementTree import ParseError
+    try:
+        # Get csproj path
+        csproj_path = _get_dotnet_main_project_csproj(dirPath)
 
-    return replace_dict
+        # Absolute .csproj references
+        abs_references = _get_dotnet_project_references(csproj_path)
+        if not any(abs_references):
+            return None
 
+        transitives_references = _get_dotnet_transitive_missing_references(abs_references)
 
-# Zip all local project references needed to compile the dotnet webapp
-def zip_dotnet_project_references(dirPath, zip_file_path):
-    # Get csproj path
-    csproj_path = _get_dotnet_main_project_csproj(dirPath)
+        # Compute new webapp .csproj
+        with open(csproj_path, "r", encoding="utf-8-sig") as csproj_file:
+            csproj_content = csproj_file.read()
+        replace_dict = {include: _get_dotnet_reference_arcname(dirPath, include) for include in abs_references}
+        new_csproj_content = _rewrite_dotnet_project_references(csproj_content, replace_dict)
 
-    # Absolute .csproj references
-    abs_references = _get_dotnet_project_references(csproj_path)
+        return csproj_path, new_csproj_content, abs_references, transitives_references
+    except (OSError, ValueError, TypeError, ParseError):
+        logger.warning("Analysing and bundling dotnet project references have failed.")
+    return None
 
-    if any(abs_references):
-        tmp_zip_file_path = "{}.tmp".format(zip_file_path)
 
-        # Step 1: init .zip.tmp
-        with zipfile.ZipFile(tmp_zip_file_path, "w", zipfile.ZIP_DEFLATED) as tmp_zf:
-            tmp_zf.mkdir(DOTNET_REFERENCES_DIR_IN_ZIP)
+# Path in the zip archive of a referenced project .csproj
+def _get_dotnet_reference_arcname(dirPath, include):
+    abs_include = os.path.abspath(os.path.join(dirPath, include))
+    dirname_include = os.path.dirname(abs_include)
+    return os.path.join(
+        DOTNET_REFERENCES_DIR_IN_ZIP, os.path.basename(dirname_include), abs_include[len(dirname_include) + 1:])
 
-        # Step 2: append webapp project references to .zip.tmp + compute new webapp .csproj
-        replace_dict = _append_dotnet_references(dirPath, abs_references, tmp_zip_file_path)
 
-        with open(csproj_path, "r", encoding="utf-8-sig") as csproj_file:
-            csproj_content = csproj_file.read()
-            new_csproj_content = str(csproj_content)
+# replace_dict: key[str]=project reference path, value[str]=new project reference
+def _rewrite_dotnet_project_references(csproj_content, replace_dict):
+    # replace all the references in a single pass, longest first so that a reference which is contained in
+    # another one doesn't shadow it
+    references_pattern = re.compile('|'.join(re.escape(k) for k in sorted(replace_dict, key=len, reverse=True)))
+    return references_pattern.sub(lambda m: replace_dict[m.group(0)], csproj_content)
 
-            for k, v in replace_dict.items():
-                new_csproj_content = str(new_csproj_content).replace(k, v)
 
-        # Step 3: append transitive project references to .zip.tmp
-        transitives_references = _get_dotnet_transitive_missing_references(abs_references)
-        if any(transitives_references):
-            _append_dotnet_references(dirPath, transitives_references, tmp_zip_file_path)
-
-        # Step 4: copy the content from the original .zip archive to the .zip.tmp archive
-        with zipfile.ZipFile(tmp_zip_file_path, "a", zipfile.ZIP_DEFLATED) as tmp_zf:
-            # Backup main project .csproj
-            tmp_zf.write(
-                csproj_path, csproj_path[len(dirPath) + 1:] + ".bak")
-            # New main project .csproj
-            tmp_zf.writestr(csproj_path[len(dirPath) + 1:], new_csproj_content)
-            # Copy each original .zip file excluding the .csproj
-            with zipfile.ZipFile('{}'.format(zip_file_path), "r", zipfile.ZIP_DEFLATED) as original_zf:
-                for original_info in original_zf.infolist():
-                    if not original_info.filename.endswith('.csproj'):
-                        with original_zf.open(original_info.filename) as original_file:
-                            content = original_file.read()
-                            tmp_zf.writestr(original_info.filename, content)
-
-        # Step 5: remove original .zip and rename de .zip.tmp
-        os.remove(zip_file_path)
-        os.rename(tmp_zip_file_path, zip_file_path)
+# Append dotnet references in a zip file according to a list of absolute references
+def _append_dotnet_references(zf, dirPath, abs_references):
+    for include in abs_references:
+        abs_include = os.path.abspath(os.path.join(dirPath, include))
+        dirname_include = os.path.dirname(abs_include)
+        basename_dir_include = os.path.basename(dirname_include)
+
+        # Copy project references (excluding obj, bin and tooling folders)
+        for _dirname, subdirs, files in _scandir_walk(dirname_include):
+            subdirs[:] = [d for d in subdirs if not _skip_dir_in_zip(d.name, NETCORE_RUNTIME_NAME)]
+            for file_entry in files:
+                absname = file_entry.path
+                arcname = os.path.join(
+                    DOTNET_REFERENCES_DIR_IN_ZIP, basename_dir_include, absname[len(dirname_include) + 1:])
+                zf.write(absname, arcname)
+
+        # backup project reference .csproj
+        zf.write(abs_include, _get_dotnet_reference_arcname(dirPath, include) + ".bak")
+
+
+# Zip all local project references needed to compile the dotnet webapp, along with the rewritten main project
+# .csproj computed by _get_dotnet_references_to_bundle. zf is the webapp zip archive being written, which must
+# not already contain the main project .csproj.
+def zip_dotnet_project_references(zf, dirPath, csproj_path, new_csproj_content, abs_references,
+                                  transitives_references):
+    zf.mkdir(DOTNET_REFERENCES_DIR_IN_ZIP)
+
+    # Step 1: add webapp project references
+    _append_dotnet_references(zf, dirPath, abs_references)
+
+    # Step 2: add transitive project references
+    if any(transitives_references):
+        _append_dotnet_references(zf, dirPath, transitives_references)
+
+    # Step 3: backup main project .csproj and add the new one
+    zf.write(csproj_path, csproj_path[len(dirPath) + 1:] + ".bak")
+    zf.writestr(csproj_path[len(dirPath) + 1:], new_csproj_content)
 # endregion
@@ -6515,7 +6515,13 @@ def webapp_up(cmd, name=None, resource_group_name=None, plan=None, location=None
     _site_availability = get_site_availability(cmd, name)
     _create_new_app = _site_availability.name_available
     runtime = _StackRuntimeHelper.remove_delimiters(runtime)
-    os_name = os_type if os_type else detect_os_from_src(src_dir, html, runtime)
+    _lang_details = None
+    if not runtime:
+        # detect the language once for the whole command. is_linux only matters for dotnet projects, and these
+        # are only deployed on Linux when the OS is given
+        _lang_details = get_lang_from_content(src_dir, html,
+                                              is_linux=bool(os_type) and os_type.lower() == LINUX_OS_NAME)
+    os_name = os_type if os_type else detect_os_from_src(src_dir, html, runtime, lang_details=_lang_details)
     _is_linux = os_name.lower() == LINUX_OS_NAME
     helper = _StackRuntimeHelper(cmd, linux=_is_linux, windows=not _is_linux)
 
@@ -6530,7 +6536,6 @@ def webapp_up(cmd, name=None, resource_group_name=None, plan=None, location=None
         detected_version = '-'
     else:
         # detect the version
-        _lang_details = get_lang_from_content(src_dir, html, is_linux=_is_linux)
         language = _lang_details.get('language')
         _data = get_runtime_version_details(_lang_details.get('file_loc'), language, helper, _is_linux)
         version_used_create = _data.get('to_create')
@@ -6585,7 +6590,7 @@ def webapp_up(cmd, name=None, resource_group_name=None, plan=None, location=None
         site_config = client.web_apps.get_configuration(rg_name, name)
     else:  # need to create new app, check if we need to use default RG or use user entered values
         logger.warning("The webapp '%s' doesn't exist", name)
-        sku = get_sku_to_use(src_dir, html, sku, runtime, app_service_environment)
+        sku = get_sku_to_use(src_dir, html, sku, runtime, app_service_environment, lang_details=_lang_details)
         loc = set_location(cmd, sku, location)
         rg_name = get_rg_to_use(user, resource_group_name)
         _create_new_rg = not check_resource_group_exists(cmd, rg_name)
@@ -5,8 +5,10 @@
 import unittest
 from unittest import mock
 import os
+import tempfile
+import zipfile
 
-from azure.core.exceptions import HttpResponseError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
 from azure.mgmt.web import WebSiteManagementClient
 from knack.util import CLIError
@@ -28,6 +30,13 @@ from azure.cli.command_modules.appservice.custom import (set_deployment_user,
                                                          restore_snapshot,
                                                          create_managed_ssl_cert,
                                                          add_github_actions)
+from azure.cli.command_modules.appservice._create_util import (_get_zip_compress_level, get_lang_from_content,
+                                                               get_sku_to_use, detect_os_from_src, detect_dotnet_lang,
+                                                               parse_dotnet_version, parse_netcore_version,
+                                                               zip_contents_from_dir, find_key_in_json,
+                                                               _rewrite_dotnet_project_references,
+                                                               detect_dotnet_version_tocreate, web_client_factory,
+                                                               get_app_details, should_create_new_app, set_location)
 
 # pylint: disable=line-too-long
 from azure.cli.core.profiles import ResourceType
@@ -451,6 +460,281 @@ class TestWebappMocked(unittest.TestCase):
                                                                      certificate_envelope=cert_def)
 
 
+class TestWebappUpHelpersMocked(unittest.TestCase):
+    def _write_file(self, path, content=''):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util._find_lang_marker_file')
+    def test_lang_detection_skips_walk_for_root_markers(self, find_marker_mock):
+        with tempfile.TemporaryDirectory() as src_dir:
+            self._write_file(os.path.join(src_dir, 'requirements.txt'))
+            self.assertEqual(get_lang_from_content(src_dir)['language'], 'python')
+        find_marker_mock.assert_not_called()
+
+    def test_lang_detection_prunes_dependency_dirs(self):
+        csproj = '<Project><PropertyGroup><TargetFramework>net6.0</TargetFramework></PropertyGroup></Project>'
+        with tempfile.TemporaryDirectory() as src_dir:
+            for skipped_dir in ['.venv', '__pycache__', 'node_modules', 'bin', 'obj', '.git']:
+                self._write_file(os.path.join(src_dir, skipped_dir, 'app.csproj'), csproj)
+            with self.assertRaises(CLIError):
+                get_lang_from_content(src_dir)
+
+            app_csproj = os.path.join(src_dir, 'src', 'app', 'app.csproj')
+            self._write_file(app_csproj, csproj)
+            details = get_lang_from_content(src_dir)
+            self.assertEqual(details['language'], 'dotnet')
+            self.assertEqual(details['file_loc'], app_csproj)
+
+    def test_lang_detection_finds_csproj_under_env_dirs(self):
+        # env and venv are only Python virtual environments by convention, a dotnet project may live there
+        csproj = '<Project><PropertyGroup><TargetFramework>net6.0</TargetFramework></PropertyGroup></Project>'
+        for dir_name in ['env', 'venv']:
+            with tempfile.TemporaryDirectory() as src_dir:
+                app_csproj = os.path.join(src_dir, dir_name, 'app.csproj')
+                self._write_file(app_csproj, csproj)
+                self.assertEqual(get_lang_from_content(src_dir)['file_loc'], app_csproj)
+
+    def test_lang_detection_reflects_source_changes(self):
+        with tempfile.TemporaryDirectory() as src_dir:
+            self._write_file(os.path.join(src_dir, 'package.json'), '{}')
+            self.assertEqual(get_lang_from_content(src_dir)['language'], 'node')
+            # a later detection, e.g. the next command of a long-lived CLI, sees the new content
+            self._write_file(os.path.join(src_dir, 'requirements.txt'))
+            self.assertEqual(get_lang_from_content(src_dir)['language'], 'python')
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util.get_lang_from_content')
+    def test_webapp_up_helpers_reuse_detected_lang(self, get_lang_mock):
+        lang_details = {'language': 'python', 'file_loc': 'requirements.txt', 'default_sku': 'B1'}
+        self.assertEqual(get_sku_to_use('src', lang_details=lang_details), 'B1')
+        self.assertEqual(detect_os_from_src('src', lang_details=lang_details), 'Linux')
+        get_lang_mock.assert_not_called()
+
+        get_lang_mock.return_value = {'language': 'dotnet', 'file_loc': 'app.csproj', 'default_sku': 'F1'}
+        self.assertEqual(get_sku_to_use('src'), 'F1')
+        self.assertEqual(detect_os_from_src('src'), 'Windows')
+        self.assertEqual(get_lang_mock.call_count, 2)
+
+    def test_parse_csproj_with_several_target_frameworks(self):
+        with tempfile.TemporaryDirectory() as src_dir:
+            csproj_path = os.path.join(src_dir, 'app.csproj')
+            self._write_file(csproj_path, '<Project Sdk="Microsoft.NET.Sdk.Web">'
+                                          '<PropertyGroup><TargetFramework>netcoreapp3.1</TargetFramework></PropertyGroup>'
+                                          '<PropertyGroup><TargetFramework>net6.0</TargetFramework></PropertyGroup>'
+                                          '</Project>')
+            # the first TargetFramework wins
+            self.assertEqual(detect_dotnet_lang(csproj_path), 'dotnetcore')
+            self.assertEqual(parse_netcore_version(csproj_path), ['3.1'])
+            self.assertEqual(parse_dotnet_version(csproj_path, '4.8'), '3.1')
+
+    def test_parse_csproj_with_msbuild_namespace(self):
+        with tempfile.TemporaryDirectory() as src_dir:
+            csproj_path = os.path.join(src_dir, 'app.csproj')
+            self._write_file(csproj_path, '<?xml version="1.0" encoding="utf-8"?>'
+                                          '<Project xmlns="http://schemas.microsoft.com/developer/msbuild/2003">'
+                                          '<PropertyGroup><TargetFramework>net48</TargetFramework>'
+                                          '<TargetFrameworkVersion>v4.7.2</TargetFrameworkVersion></PropertyGroup>'
+                                          '</Project>')
+            self.assertEqual(detect_dotnet_lang(csproj_path), 'aspnet')
+            # TargetFrameworkVersion is preferred, even when it comes after TargetFramework
+            self.assertEqual(parse_dotnet_version(csproj_path, '4.8'), '4.7')
+            self.assertEqual(detect_dotnet_lang(csproj_path, is_linux=True), 'dotnetcore')
+
+    def test_parse_csproj_without_target_framework(self):
+        with tempfile.TemporaryDirectory() as src_dir:
+            csproj_path = os.path.join(src_dir, 'app.csproj')
+            self._write_file(csproj_path, '<Project Sdk="Microsoft.NET.Sdk"></Project>')
+            self.assertEqual(detect_dotnet_lang(csproj_path), 'aspnet')
+            self.assertEqual(parse_netcore_version(csproj_path), ['0.0'])
+            self.assertEqual(parse_dotnet_version(csproj_path, '4.8'), '4.8')
+
+    def _zip_dotnet_app(self, src_dir):
+        # project references are resolved from the current directory, as `az webapp up` runs in the app dir
+        cwd = os.getcwd()
+        os.chdir(src_dir)
+        try:
+            zip_file_path = zip_contents_from_dir(src_dir, 'dotnetcore')
+        finally:
+            os.chdir(cwd)
+        try:
+            with zipfile.ZipFile(zip_file_path) as zf:
+                return {name: zf.read(name) for name in zf.namelist()}
+        finally:
+            os.remove(zip_file_path)
+
+    def _write_dotnet_solution(self, root_dir, app_csproj_encoding='utf-8'):
+        self._write_file(os.path.join(root_dir, 'Lib', 'Lib.csproj'),
+                         '<Project><ItemGroup><ProjectReference Include="../Core/Core.csproj" /></ItemGroup>'
+                         '</Project>')
+        self._write_file(os.path.join(root_dir, 'Lib', 'Lib.cs'))
+        self._write_file(os.path.join(root_dir, 'Lib', 'bin', 'Lib.dll'))
+        self._write_file(os.path.join(root_dir, 'Core', 'Core.csproj'), '<Project></Project>')
+        self._write_file(os.path.join(root_dir, 'Core', 'Core.cs'))
+        app_dir = os.path.join(root_dir, 'App')
+        self._write_file(os.path.join(app_dir, 'Program.cs'))
+        with open(os.path.join(app_dir, 'App.csproj'), 'w', encoding=app_csproj_encoding) as f:
+            f.write('<Project><!-- caf\u00e9 --><ItemGroup><ProjectReference Include="../Lib/Lib.csproj" />'
+                    '</ItemGroup></Project>')
+        return app_dir
+
+    def test_zip_dotnet_project_references(self):
+        with tempfile.TemporaryDirectory() as root_dir:
+            app_dir = self._write_dotnet_solution(root_dir)
+            zip_content = self._zip_dotnet_app(app_dir)
+
+        self.assertEqual(set(zip_content), {
+            'Program.cs', 'App.csproj', 'App.csproj.bak', '.az-references/',
+            '.az-references/Lib/Lib.csproj', '.az-references/Lib/Lib.csproj.bak', '.az-references/Lib/Lib.cs',
+            '.az-references/Core/Core.csproj', '.az-references/Core/Core.csproj.bak', '.az-references/Core/Core.cs'})
+        new_reference = os.path.join('.az-references', 'Lib', 'Lib.csproj')
+        self.assertIn('<ProjectReference Include="{}" />'.format(new_reference), zip_content['App.csproj'].decode())
+        self.assertIn('Include="../Lib/Lib.csproj"', zip_content['App.csproj.bak'].decode())
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util.logger')
+    def test_zip_dotnet_project_references_fallback(self, logger_mock):
+        # a main .csproj that can't be read falls back to zipping the project as is
+        with tempfile.TemporaryDirectory() as root_dir:
+            app_dir = self._write_dotnet_solution(root_dir, app_csproj_encoding='iso-8859-1')
+            with open(os.path.join(app_dir, 'App.csproj'), 'rb') as f:
+                app_csproj = f.read()
+            zip_content = self._zip_dotnet_app(app_dir)
+
+        self.assertEqual(zip_content, {'Program.cs': b'', 'App.csproj': app_csproj})
+        logger_mock.warning.assert_called_once_with("Analysing and bundling dotnet project references have failed.")
+
+    def test_rewrite_overlapping_dotnet_project_references(self):
+        # 'Lib/Core.csproj' is contained in '../Other/Lib/Core.csproj', the longer one must not be rewritten twice
+        replace_dict = {'Lib/Core.csproj': '.az-references/Lib/Core.csproj',
+                        '../Other/Lib/Core.csproj': '.az-references/Lib1/Core.csproj'}
+        csproj_content = ('<ProjectReference Include="Lib/Core.csproj" />'
+                          '<ProjectReference Include="../Other/Lib/Core.csproj" />')
+
+        self.assertEqual(_rewrite_dotnet_project_references(csproj_content, replace_dict),
+                         '<ProjectReference Include=".az-references/Lib/Core.csproj" />'
+                         '<ProjectReference Include=".az-references/Lib1/Core.csproj" />')
+
+    def test_find_key_in_json_matches_exact_keys(self):
+        json_data = {'hostname': 'h', 'name2': 'n2', 'name': 'a',
+                     'nested': {'myname': 'm', 'name': 'b', 'deeper': {'name': 'c'}},
+                     'after': {'name': 'd'}}
+
+        # keys only containing 'name' used to match too
+        self.assertEqual(list(find_key_in_json(json_data, 'name')), ['a', 'b', 'c', 'd'])
+        self.assertEqual(list(find_key_in_json(json_data, 'missing')), [])
+
+    def test_find_key_in_json_deep_nesting(self):
+        json_data = value = {}
+        for _ in range(5000):
+            value['child'] = {}
+            value = value['child']
+        value['engines'] = {'node': '18'}
+
+        self.assertEqual(list(find_key_in_json(json_data, 'engines')), [{'node': '18'}])
+
+    def test_detect_dotnet_version_tocreate(self):
+        # the supported versions aren't sorted, and are compared numerically rather than as strings
+        self.assertEqual(detect_dotnet_version_tocreate('6.0', '8.0', ['8.0', '6.0', '7.0']), '6.0')
+        self.assertEqual(detect_dotnet_version_tocreate('3.1', '8.0', ['8.0', '6.0']), '6.0')
+        self.assertEqual(detect_dotnet_version_tocreate('10.0', '8.0', ['6.0', '8.0']), '8.0')
+        self.assertEqual(detect_dotnet_version_tocreate('4.5', 'V4.8', ['V4.8', 'V3.5']), 'V4.8')
+        self.assertEqual(detect_dotnet_version_tocreate('2.0', 'V4.8', ['V4.8', 'V3.5']), 'V3.5')
+
+    @mock.patch('azure.cli.core._profile.Profile')
+    @mock.patch('azure.cli.command_modules.appservice._create_util.get_mgmt_service_client')
+    def test_web_client_factory_reuses_clients(self, client_factory_mock, profile_mock):
+        client_factory_mock.side_effect = lambda *_: mock.MagicMock()
+        subscription = {'id': 'sub1', 'tenantId': 'tenant1', 'user': {'name': 'user@contoso.com'}}
+        profile_mock.return_value.get_subscription.side_effect = lambda *_: dict(subscription)
+        cli_ctx = mock.MagicMock(data={})
+        cli_ctx.cloud.name = 'AzureCloud'
+
+        client = web_client_factory(cli_ctx)
+        self.assertIs(web_client_factory(cli_ctx), client)
+
+        # az account set
+        subscription['id'] = 'sub2'
+        other_subscription_client = web_client_factory(cli_ctx)
+        self.assertIsNot(other_subscription_client, client)
+
+        # az login with another account
+        subscription['user'] = {'name': 'other@contoso.com'}
+        other_account_client = web_client_factory(cli_ctx)
+        self.assertIsNot(other_account_client, other_subscription_client)
+
+        # az cloud set
+        cli_ctx.cloud.name = 'AzureChinaCloud'
+        self.assertIsNot(web_client_factory(cli_ctx), other_account_client)
+        self.assertEqual(client_factory_mock.call_count, 4)
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util._resource_client_factory', autospec=True)
+    @mock.patch('azure.cli.command_modules.appservice._create_util.web_client_factory', autospec=True)
+    def test_get_app_details(self, client_factory_mock, resource_client_factory_mock):
+        client = mock.MagicMock()
+        client_factory_mock.return_value = client
+        resources = resource_client_factory_mock.return_value.resources
+        resource = mock.MagicMock(id='/subscriptions/sub1/resourceGroups/myRG/providers/Microsoft.Web/sites/myApp')
+        resource.name = 'myApp'
+        resources.list.return_value = iter([resource])
+
+        self.assertIs(get_app_details(mock.MagicMock(), "myApp"), client.web_apps.get.return_value)
+        resources.list.assert_called_once_with(
+            filter="resourceType eq 'Microsoft.Web/sites' and name eq 'myApp'")
+        client.web_apps.get.assert_called_once_with(name='myApp', resource_group_name='myRG')
+        client.web_apps.list.assert_not_called()
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util._resource_client_factory', autospec=True)
+    @mock.patch('azure.cli.command_modules.appservice._create_util.web_client_factory', autospec=True)
+    def test_get_app_details_not_found(self, client_factory_mock, resource_client_factory_mock):
+        # e.g. the name is taken in another subscription
+        client = mock.MagicMock()
+        client_factory_mock.return_value = client
+        resource_client_factory_mock.return_value.resources.list.return_value = iter([])
+
+        self.assertIsNone(get_app_details(mock.MagicMock(), "myApp"))
+        client.web_apps.get.assert_not_called()
+        client.web_apps.list.assert_not_called()
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util.web_client_factory', autospec=True)
+    def test_should_create_new_app(self, client_factory_mock):
+        client = mock.MagicMock()
+        client_factory_mock.return_value = client
+
+        client.web_apps.get.side_effect = ResourceNotFoundError('not found')
+        self.assertTrue(should_create_new_app(mock.MagicMock(), 'myRG', 'myApp'))
+        client.web_apps.get.assert_called_once_with(resource_group_name='myRG', name='myApp')
+
+        client.web_apps.get.side_effect = None
+        self.assertFalse(should_create_new_app(mock.MagicMock(), 'myRG', 'myApp'))
+        client.web_apps.list_by_resource_group.assert_not_called()
+
+    @mock.patch('azure.cli.command_modules.appservice._create_util.web_client_factory', autospec=True)
+    def test_set_location(self, client_factory_mock):
+        list_geo_regions = client_factory_mock.return_value.list_geo_regions
+        west_us, east_us = mock.MagicMock(), mock.MagicMock()
+        west_us.name, east_us.name = 'West US', 'East US'
+        list_geo_regions.return_value = iter([west_us, east_us])
+        self.assertEqual(set_location(mock.MagicMock(), 'B1', None), 'westus')
+        list_geo_regions.assert_called_once_with('B1', True)
+
+        self.assertEqual(set_location(mock.MagicMock(), 'B1', 'East US 2'), 'eastus2')
+
+        list_geo_regions.return_value = iter([])
+        with self.assertRaisesRegex(CLIError, "'P1V3' sku"):
+            set_location(mock.MagicMock(), 'P1V3', None)
+
+    def test_zip_compress_level(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(_get_zip_compress_level(), 1)
+        for value, expected in [('0', 0), ('9', 9), (' 6 ', 6)]:
+            with mock.patch.dict(os.environ, {'AZ_APPSVC_ZIP_LEVEL': value}):
+                self.assertEqual(_get_zip_compress_level(), expected)
+        # invalid or out of range values fall back to the default level
+        for value in ['', 'fast', '1.5', '-1', '10']:
+            with mock.patch.dict(os.environ, {'AZ_APPSVC_ZIP_LEVEL': value}):
+                self.assertEqual(_get_zip_compress_level(), 1)
+
+
 class FakedResponse:  # pylint: disable=too-few-public-methods
     def __init__(self, status_code):
         self.status_code = status_code